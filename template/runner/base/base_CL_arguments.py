@@ -314,4 +314,50 @@ class BaseCLArguments:
                                       default=False,
                                       action='store_true',
                                       help='flag for calling the fast (and lightweight) methods of calling execute')
+        parser_inference.add_argument('--jit-model',
+                                      default=False,
+                                      action='store_true',
+                                      help='compile the model with TorchScript and freeze it for faster inference')
+        parser_inference.add_argument('--compile-model',
+                                      default=False,
+                                      action='store_true',
+                                      help='compile the model with torch.compile (slower first call, faster afterwards)')
+        parser_inference.add_argument('--quantize',
+                                      choices=['dynamic', 'static'],
+                                      default=None,
+                                      help='quantize the model to INT8 for CPU inference')
+        parser_inference.add_argument('--calibration-folder',
+                                      type=str,
+                                      default=None,
+                                      help='folder with the images used to calibrate the static quantization')
+        parser_inference.add_argument('--backend',
+                                      choices=['torch', 'ort'],
+                                      default='torch',
+                                      help='run the forward pass with PyTorch or with ONNX Runtime (requires --no-cuda)')
+        parser_inference.add_argument('--max-batch-size',
+                                      type=int,
+                                      default=1,
+                                      help='group concurrent inference calls into mini-batches of up to this size '
+                                           '(the input is then copied to the GPU through preallocated buffers)')
+        parser_inference.add_argument('--max-wait-ms',
+                                      type=float,
+                                      default=5,
+                                      help='maximal time in milliseconds a call waits for others to join its mini-batch')
+        parser_inference.add_argument('--preprocess-workers',
+                                      type=int,
+                                      default=0,
+                                      help='number of processes loading and transforming the images, useful only with '
+                                           'concurrent callers (0 to do it inline)')
+        parser_inference.add_argument('--precision',
+                                      choices=['fp32', 'fp16', 'bf16'],
+                                      default='fp32',
+                                      help='floating point precision of the model and its input during inference')
+        parser_inference.add_argument('--num-threads',
+                                      type=int,
+                                      default=None,
+                                      help='number of CPU threads used for inference (half of the cores by default)')
+        parser_inference.add_argument('--gpu-decode',
+                                      default=False,
+                                      action='store_true',
+                                      help='decode JPEG images and apply the transform on the GPU')
 
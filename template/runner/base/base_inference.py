@@ -6,39 +6,124 @@ instead of hard-coding stuff.
 """
 # Utils
 import base64
+import functools
+import importlib.util
+import inspect
 import io
 import logging
+import multiprocessing
 import os
+import platform
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # Delegated
+import numpy as np
 import torch
 from PIL import Image
+from torchvision import transforms
+from torchvision.transforms import functional as F
+from torchvision.datasets.folder import IMG_EXTENSIONS
 
+from datasets.custom.transforms import OnlyImage
 from template.runner.base import AbstractRunner
-from template.runner.base.base_routine import BaseRoutine
 from template.runner.base.base_setup import BaseSetup
+from template.runner.base.inference_batcher import InferenceBatcher
 import util.transforms as T
-from util.misc import pil_loader, convert_to_rgb
+from util.misc import pil_loader, convert_to_rgb, get_all_files_in_folders_and_subfolders, has_extension, \
+    inference_mode
+
+# Models made only of modules supported by eager mode static quantization (no residual additions or other
+# functional ops on the activations)
+STATIC_QUANTIZATION_MODELS = ('CNN_basic', 'AlexNet', 'VGG')
+
+# Sequences of modules fused together before static quantization
+FUSION_PATTERNS = [(torch.nn.Conv2d, torch.nn.BatchNorm2d, torch.nn.ReLU),
+                   (torch.nn.Conv2d, torch.nn.BatchNorm2d),
+                   (torch.nn.Conv2d, torch.nn.ReLU),
+                   (torch.nn.Linear, torch.nn.ReLU)]
+
+# State of the preprocessing worker processes, set once when each worker starts
+_worker_state = {}
+
+
+def _init_preprocess_worker(runner_class, transform, draft_size):
+    """Store the runner class, the transform and the JPEG draft size in the worker process"""
+    # The workers run in parallel already, more threads each would oversubscribe the cores
+    torch.set_num_threads(1)
+    _worker_state.update(runner_class=runner_class, transform=transform, draft_size=draft_size)
+
+
+def _preprocess_in_worker(input_folder, input_image):
+    """Load and transform an image in a preprocessing worker process"""
+    return _worker_state['runner_class']._load_and_transform(input_folder=input_folder,
+                                                             input_image=input_image,
+                                                             transform=_worker_state['transform'],
+                                                             draft_size=_worker_state['draft_size'])
 
 
 class BaseInference(AbstractRunner):
 
-    def __init__(self):
+    def __init__(self, num_threads=None, load_model=None, **kwargs):
         """
+        Parameters
+        ----------
+        num_threads : int
+            Number of threads used by PyTorch for intra-op parallelism. Defaults to half of the CPU cores.
+        load_model : str
+            Path to the checkpoint. If given, it starts being read from disk in background right away.
+
         Attributes
         ----------
         setup = BaseSetup
             (strategy design pattern) Object responsible for setup operations
         """
         self.setup = BaseSetup()
+        self._set_up_threads(num_threads)
+        self._checkpoint_future = None
+        if load_model is not None and os.path.isfile(load_model):
+            executor = ThreadPoolExecutor(max_workers=1)
+            self._checkpoint_future = executor.submit(self._load_checkpoint, load_model=load_model)
+            # Does not block, the submitted load keeps running
+            executor.shutdown(wait=False)
+        self.ort_sess = None
+        self.batcher = None
+        self.preprocess_pool = None
+        self.gpu_transform = None
+        # Pinned host buffer and device buffer for the input, allocated once and reused by the batcher worker.
+        # Only used with --max-batch-size > 1, calls without batching copy their input on their own.
+        self._pinned = None
+        self._gpu_buf = None
+        self._copy_done = None
 
-    def single_run(self, pre_load, **kwargs):
+    def single_run(self, pre_load, jit_model=False, compile_model=False, quantize=None, backend='torch',
+                   max_batch_size=1, max_wait_ms=5, preprocess_workers=0, precision='fp32',
+                   gpu_decode=False, **kwargs):
         """ Performs inference only
 
         Parameters
         ----------
         pre_load : bool
             Flag for only loading the model
+        jit_model : bool
+            Flag for compiling the model with TorchScript and freezing it
+        compile_model : bool
+            Flag for compiling the model with torch.compile. The compilation happens on the first forward pass.
+        quantize : str
+            If set, quantize the model to INT8. Either 'dynamic' or 'static'. CPU only.
+        backend : str
+            Backend running the forward pass. Either 'torch' or 'ort' (ONNX Runtime, CPU only).
+        max_batch_size : int
+            If greater than 1, concurrent calls are grouped into mini-batches of up to this size
+        max_wait_ms : float
+            Maximal time (in milliseconds) a call waits for others to join its mini-batch
+        preprocess_workers : int
+            If greater than 0, images are loaded and transformed in a pool of this many processes. Each call
+            still waits for its own image, so this pays off only with concurrent callers (e.g. a server);
+            a single caller only gets the inter-process overhead.
+        precision : str
+            Floating point precision of the model and its input. One of 'fp32', 'fp16' or 'bf16'.
+        gpu_decode : bool
+            Flag for decoding JPEG images with nvJPEG and transforming them directly on the GPU
 
         Returns
         -------
@@ -46,32 +131,97 @@ class BaseInference(AbstractRunner):
         """
         # Load the model if it does not exist yet
         if not hasattr(self, 'model') or not hasattr(self, 'transform'):
-            self.model = self.setup.setup_model(**kwargs)
+            if compile_model and not hasattr(torch, 'compile'):
+                raise ValueError("--compile-model requires PyTorch >= 2.0")
+            if precision != 'fp32' and quantize is not None:
+                raise ValueError("--precision cannot be used together with --quantize")
+            if backend == 'ort' and not kwargs.get('no_cuda', False):
+                raise ValueError("ONNX Runtime runs only on CPU. Use --no-cuda together with --backend ort.")
+            if backend == 'ort' and (importlib.util.find_spec('onnxruntime') is None
+                                     or importlib.util.find_spec('torch.onnx.symbolic_opset17') is None):
+                raise ValueError("--backend ort requires onnxruntime and PyTorch >= 1.13 (ONNX opset 17)")
+            if precision == 'bf16' and backend == 'ort':
+                raise ValueError("--precision bf16 is not supported by --backend ort")
+            if self._checkpoint_future is not None:
+                # Checkpoint prefetched in background since the construction of the runner
+                checkpoint = self._checkpoint_future.result()
+                self._checkpoint_future = None
+            else:
+                checkpoint = self._load_checkpoint(**kwargs)
+            # The checkpoint is loaded only once, the setup takes the weights from it
+            self.model = self.setup.setup_model(checkpoint=checkpoint, **kwargs)
             self.model.eval()
-            checkpoint = self._load_checkpoint(**kwargs)
             if 'test_transform' in checkpoint:
-                self.transform = checkpoint['test_transform']
+                self.transform = self._resize_before_to_tensor(checkpoint['test_transform'])
             else:
                 logging.info("Test transform not found in checkpoint. Using ToTensor().")
                 self.transform = T.Compose([T.ToTensor()])
+            self.draft_size = self._get_draft_size(self.transform)
+            if preprocess_workers == 0:
+                # Scripted modules cannot be pickled, hence not sent to the preprocessing workers
+                self.transform = self._script_tensor_transforms(self.transform)
+            if gpu_decode and not kwargs.get('no_cuda', False) and preprocess_workers == 0:
+                if not self._gpu_decode_available():
+                    logging.warning("This torchvision cannot decode JPEG on the GPU, JPEG are decoded on CPU")
+                else:
+                    self.gpu_transform = self._to_tensor_transform(self.transform)
+                    if self.gpu_transform is None:
+                        logging.warning("The test transform cannot run on image tensors, JPEG are decoded on CPU")
 
             self.classes = checkpoint['classes']
+            # Plain list for fast indexing with a Python int (mappings are kept as they are)
+            self._classes = self.classes if isinstance(self.classes, dict) else list(self.classes)
+            self.input_size = self._get_input_size(checkpoint)
+            # Shape of the preprocessed images, used to warm up the model. Transforms keeping the aspect ratio
+            # give other shapes for non square images: only the one of an image of the expected size is warmed up.
+            size = self.input_size[::-1] if self.input_size is not None else (128, 128)
+            self.input_shape = tuple(self.transform(Image.new('RGB', size)).shape)
+
+            if quantize is not None:
+                self.model = self._quantize(quantize=quantize, **kwargs)
+            self.dtype = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}[precision]
+            if self.dtype != torch.float32:
+                self.model = self.model.to(self.dtype)
+            if backend == 'ort':
+                self.ort_sess = self._to_onnxruntime()
+            elif jit_model:
+                self.model = self._to_torchscript(**kwargs)
+            elif compile_model:
+                # Without batching the batch size is always 1, hence shapes are specialized (dynamic=False).
+                # With batching it varies: let dynamo mark it dynamic instead of recompiling for each size.
+                self.model = torch.compile(self._unwrap_model(self.model), mode="reduce-overhead", fullgraph=False,
+                                           dynamic=False if max_batch_size == 1 else None)
+
+            if max_batch_size > 1:
+                self.batcher = InferenceBatcher(forward=functools.partial(self._forward_batch,
+                                                                          no_cuda=kwargs.get('no_cuda', False)),
+                                                max_batch_size=max_batch_size,
+                                                max_wait_ms=max_wait_ms)
+
+            if preprocess_workers > 0:
+                # The transform is sent only once to each worker, not with every image. Workers are spawned,
+                # forking a process with CUDA initialized and threads running can deadlock in the children.
+                self.preprocess_pool = ProcessPoolExecutor(max_workers=preprocess_workers,
+                                                           mp_context=multiprocessing.get_context('spawn'),
+                                                           initializer=_init_preprocess_worker,
+                                                           initargs=(type(self), self.transform, self.draft_size))
 
         if pre_load:
             # Check no images to process are given
             assert kwargs['input_image'] is None
             assert kwargs['input_folder'] is None
-            # Create a fake empty image to process
-            buffered = io.BytesIO()
-            Image.new('RGB', (128, 128)).save(buffered, format="PNG")
-            kwargs['input_image'] = base64.b64encode(buffered.getvalue()).decode('utf-8')
-
-        # Load and preprocess the data
-        img = self.preprocess(**kwargs)
+            # Warm up with an empty input, skipping decoding and preprocessing altogether
+            img = self._warm_up_input(**kwargs)
+        else:
+            # Load and preprocess the data
+            img = self.preprocess(**kwargs)
 
         # Forward Pass
-        with torch.no_grad():
-            output = self.model(img)
+        if self.batcher is not None:
+            output = self.batcher.submit(img).result()
+        else:
+            with inference_mode():
+                output = self._forward(img)
 
         if pre_load:
             # Return a standard answer
@@ -82,6 +232,29 @@ class BaseInference(AbstractRunner):
             # Return post-processed output
             return self.postprocess(output, **kwargs)
 
+    def _warm_up_input(self, no_cuda=False, **kwargs):
+        """Create the empty mini-batch fed to the model when only loading it
+
+        Returns
+        -------
+        img : torch.Tensor | torch.cuda.Tensor
+            A zero tensor with the shape the test transform outputs for an image of the expected input size
+        """
+        return torch.zeros(1, *self.input_shape, dtype=self.dtype, device='cpu' if no_cuda else 'cuda')
+
+    @staticmethod
+    def _set_up_threads(num_threads=None):
+        """Configure the thread pools once for the whole life of the service, to avoid oversubscribing the cores"""
+        if num_threads is None:
+            num_threads = max(1, os.cpu_count() // 2)
+        torch.set_num_threads(num_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError as exp:
+            # It can be set only before any inter-op parallel work has started
+            logging.warning(f"Could not set the number of inter-op threads: {exp}")
+        logging.info(f"Using {num_threads} threads for inference")
+
     ####################################################################################################################
     """
     These methods delegate their function to other classes in this package.
@@ -99,53 +272,474 @@ class BaseInference(AbstractRunner):
         -------
             A dictionary containing the loaded checkpoint
         """
-        return torch.load(load_model, map_location='cpu')
+        try:
+            # Memory-map the tensors instead of reading them all in RAM (PyTorch >= 2.1, zip file checkpoints only).
+            # weights_only cannot be used because the checkpoint also stores the pickled transforms.
+            return torch.load(load_model, map_location='cpu', mmap=True, weights_only=False)
+        except (TypeError, RuntimeError):
+            return torch.load(load_model, map_location='cpu')
+
+    def _get_input_size(self, checkpoint):
+        """Get the (height, width) the model expects, from the checkpoint or from the model class itself"""
+        if checkpoint.get('expected_input_size') is not None:
+            return tuple(checkpoint['expected_input_size'])
+        return getattr(self._unwrap_model(self.model), 'expected_input_size', None)
+
+    @staticmethod
+    def _unwrap_model(model):
+        """Remove the DataParallel wrapper from the model, if any"""
+        if isinstance(model, torch.nn.DataParallel):
+            return model.module
+        return model
+
+    def _quantize(self, quantize, no_cuda=False, calibration_folder=None, **kwargs):
+        """Quantize the weights (and for static quantization also the activations) of the model to INT8
+
+        Parameters
+        ----------
+        quantize : str
+            Type of quantization: 'dynamic' quantizes only the linear layers, 'static' quantizes the whole
+            model and requires calibration images.
+        no_cuda : bool
+            Specifies whether the GPU should be used or not. Quantized models run only on CPU.
+        calibration_folder : str
+            Path to a folder with the images used to calibrate the activations for static quantization
+
+        Returns
+        -------
+        model : torch.nn.Module
+            The quantized model
+        """
+        if not no_cuda:
+            raise ValueError("Quantized models run only on CPU. Use --no-cuda together with --quantize.")
+        model = self._unwrap_model(self.model)
 
-    def preprocess(self, input_folder, input_image, **kwargs):
+        if quantize == 'dynamic':
+            # Convolutions are not supported by dynamic quantization
+            return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        if quantize == 'static':
+            if type(model).__name__ not in STATIC_QUANTIZATION_MODELS:
+                raise ValueError(f"Static quantization is not supported for {type(model).__name__}. "
+                                 f"Supported models are {', '.join(STATIC_QUANTIZATION_MODELS)}. "
+                                 f"Use --quantize dynamic instead.")
+            if calibration_folder is None:
+                raise ValueError("Static quantization requires --calibration-folder")
+            backend = 'qnnpack' if platform.machine().lower() in ('arm64', 'aarch64') else 'fbgemm'
+            torch.backends.quantized.engine = backend
+            torch.quantization.fuse_modules(model, self._fusable_modules(model), inplace=True)
+            model = torch.quantization.QuantWrapper(model)
+            model.qconfig = torch.quantization.get_default_qconfig(backend)
+            torch.quantization.prepare(model, inplace=True)
+            # Observe the range of the activations on the calibration images
+            files = [f for f in get_all_files_in_folders_and_subfolders(calibration_folder)
+                     if has_extension(f, IMG_EXTENSIONS)]
+            logging.info(f"Calibrating the quantized model on {len(files)} images")
+            with torch.no_grad():
+                for f in files:
+                    model(self.transform(pil_loader(f)).unsqueeze(0))
+            return torch.quantization.convert(model, inplace=True)
+
+        raise ValueError(f"Unknown quantization type {quantize}")
+
+    @staticmethod
+    def _fusable_modules(model):
+        """List the names of the consecutive modules of the model matching one of the FUSION_PATTERNS
+
+        Returns
+        -------
+        groups : list(list(str))
+            Names of the modules to fuse, in the format expected by torch.quantization.fuse_modules
+        """
+        groups = []
+        for name, module in model.named_modules():
+            if not isinstance(module, torch.nn.Sequential):
+                continue
+            children = list(module.named_children())
+            i = 0
+            while i < len(children):
+                for pattern in FUSION_PATTERNS:
+                    window = children[i:i + len(pattern)]
+                    if len(window) == len(pattern) and all(type(m) is p for (_, m), p in zip(window, pattern)):
+                        groups.append([f"{name}.{n}" if name else n for n, _ in window])
+                        i += len(pattern) - 1
+                        break
+                i += 1
+        return groups
+
+    def _to_torchscript(self, no_cuda=False, **kwargs):
+        """Compile the model with TorchScript, freeze it and optimize it for inference
+
+        Scripting is attempted first. If the model does not script cleanly it is traced with a
+        dummy input of the shape produced by the test transform instead.
+
+        Parameters
+        ----------
+        no_cuda : bool
+            Specifies whether the GPU should be used or not
+
+        Returns
+        -------
+        model : torch.jit.ScriptModule
+            The frozen and optimized model
+        """
+        model = self._unwrap_model(self.model)
+        try:
+            model = torch.jit.script(model)
+        except Exception as exp:
+            logging.warning(f"Could not script the model, falling back to tracing: {exp}")
+            # Trace with the shape produced by the test transform, i.e. the one the requests will have
+            dummy = torch.zeros(1, *self.input_shape, dtype=self.dtype, device='cpu' if no_cuda else 'cuda')
+            model = torch.jit.trace(model, dummy)
+        model = torch.jit.freeze(model)
+        return torch.jit.optimize_for_inference(model)
+
+    def _to_onnxruntime(self):
+        """Export the model to ONNX and load it in an ONNX Runtime inference session
+
+        The export happens in memory, no file is written on disk.
+
+        Returns
+        -------
+        ort_sess : onnxruntime.InferenceSession
+            The session running the model on CPU with all graph optimizations enabled
+        """
+        import onnxruntime as ort
+
+        model = self._unwrap_model(self.model)
+        # Only the batch axis is dynamic, the input must have the shape produced by the test transform
+        dummy = torch.zeros(1, *self.input_shape, dtype=self.dtype, device=next(model.parameters()).device)
+        buffer = io.BytesIO()
+        torch.onnx.export(model, dummy, buffer, opset_version=17, do_constant_folding=True,
+                          input_names=['input'], output_names=['output'],
+                          dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
+
+        sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return ort.InferenceSession(buffer.getvalue(), sess_options, providers=['CPUExecutionProvider'])
+
+    def _forward(self, img):
+        """Run the forward pass of the model with the selected backend"""
+        if self.ort_sess is not None:
+            return torch.from_numpy(self.ort_sess.run(None, {'input': img.cpu().numpy()})[0])
+        return self.model(img)
+
+    def _forward_batch(self, batch, no_cuda=False):
+        """Move a mini-batch assembled by the batcher to the correct device and run the forward pass on it"""
+        if not no_cuda:
+            batch = self._copy_to_gpu(batch)
+        return self._forward(batch)
+
+    def preprocess(self, input_folder, input_image, no_cuda=False, **kwargs):
         """Load and prepares the data to be fed to the neural network
 
         Parameters
         ----------
         input_folder : str
             Path to the image to process
+        input_image : str | bytes
+            Image to process encoded in base64
+        no_cuda : bool
+            Specifies whether the GPU should be used or not
 
         Returns
         -------
         img : torch.Tensor | torch.cuda.Tensor
             The loaded and preprocessed image and moved to the correct device
         """
+        img = None
+        if self.gpu_transform is not None:
+            img = self._decode_jpeg_on_gpu(input_folder=input_folder, input_image=input_image)
+        if img is None:
+            if self.preprocess_pool is not None:
+                # Decode and transform in a worker process, outside of the GIL of this one
+                img = self.preprocess_pool.submit(_preprocess_in_worker, input_folder, input_image).result()
+            else:
+                img = self._load_and_transform(input_folder=input_folder, input_image=input_image,
+                                               transform=self.transform, draft_size=self.draft_size)
+        # Cast it to the precision of the model (no-op in FP32)
+        img = img.to(self.dtype)
+        # Move it to the correct device. When batching, the whole mini-batch is moved by the batcher, unless
+        # JPEG are decoded on the GPU: then all inputs must already be there to be concatenated.
+        # Concurrent callers may run this, hence no buffer is shared here (the caching host allocator
+        # recycles the pinned memory).
+        if not no_cuda and not img.is_cuda and (self.batcher is None or self.gpu_transform is not None):
+            img = img.pin_memory().cuda(non_blocking=True)
+        return img
+
+    def _decode_jpeg_on_gpu(self, input_folder, input_image):
+        """Decode a JPEG image directly in GPU memory with nvJPEG and transform it there
+
+        Parameters
+        ----------
+        input_folder : str
+            Path to the image to process
+        input_image : str | bytes
+            Image to process encoded in base64
+
+        Returns
+        -------
+        img : torch.cuda.Tensor
+            The preprocessed image as a mini-batch of size 1. None if the image is not a JPEG or if nvJPEG
+            cannot decode it.
+        """
+        from torchvision.io import decode_jpeg, read_file, ImageReadMode
+
+        # Peek at the JPEG magic number, anything else is decoded with PIL
+        if input_folder is not None:
+            with open(input_folder, 'rb') as f:
+                if f.read(3) != b'\xff\xd8\xff':
+                    return None
+            data = read_file(input_folder)
+        else:
+            # The base64 encoding of the JPEG magic number
+            prefix = input_image[:4]
+            if (prefix.decode('ascii', 'ignore') if isinstance(prefix, bytes) else prefix) != '/9j/':
+                return None
+            # bytearray is writable, hence the tensor can share its memory without warnings
+            data = torch.from_numpy(np.frombuffer(bytearray(base64.b64decode(input_image)), dtype=np.uint8))
+        try:
+            img = decode_jpeg(data, mode=ImageReadMode.RGB, device='cuda')
+        except RuntimeError as exp:
+            # e.g. CMYK or some progressive JPEG are not supported by nvJPEG, PIL can still decode them
+            logging.debug(f"Could not decode the JPEG on the GPU, decoding it on CPU: {exp}")
+            return None
+        return self.gpu_transform(img).unsqueeze(0)
+
+    @staticmethod
+    def _gpu_decode_available():
+        """Check whether torchvision can decode JPEG on the GPU (torchvision >= 0.10)"""
+        try:
+            from torchvision.io import decode_jpeg, read_file, ImageReadMode
+        except ImportError:
+            return False
+        return 'device' in inspect.signature(decode_jpeg).parameters
+
+    @classmethod
+    def _load_and_transform(cls, input_folder, input_image, transform, draft_size):
+        """Load the image, transform it and fake a mini-batch of size 1
+
+        This does not depend on the state of the runner, such that it can run in the preprocessing workers.
+
+        Parameters
+        ----------
+        input_folder : str
+            Path to the image to process
+        input_image : str | bytes
+            Image to process encoded in base64
+        transform : callable
+            The test transform
+        draft_size : tuple(int, int)
+            Width and height JPEG images can be decoded at by DCT scaling, None to decode them at full size
+
+        Returns
+        -------
+        img : torch.Tensor
+            The preprocessed image as a mini-batch of size 1
+        """
         # Load the image from file system from the path specifiec
         if input_folder is not None:
             assert input_image is None
-            img = self._load_image(input_folder)
+            img = cls._load_image(input_folder, draft_size=draft_size)
 
         # Load the image from base64 passed as parameter
         if input_image is not None:
             assert input_folder is None
-            img = Image.open(io.BytesIO(base64.decodebytes(input_image.encode("utf-8"))))
-            img = convert_to_rgb(img)
+            img = cls._open_image(io.BytesIO(base64.b64decode(input_image)), draft_size=draft_size)
 
         # Transform it
-        img = self.transform(img)
-        # Move it to the correct device
-        img, _ = BaseRoutine.move_to_device(input=img, **kwargs)
+        img = transform(img)
         # Fake a mini-batch of size 1
-        img = img.unsqueeze(0)
-        return img
+        return img.unsqueeze(0)
+
+    def _copy_to_gpu(self, img):
+        """Copy the input to the GPU through the pinned and device buffers
+
+        The buffers are (re)allocated only if the input does not fit in them, smaller mini-batches use a slice.
+        They are shared state: call this only from the single worker thread of the batcher.
+        """
+        if img.is_cuda:
+            return img
+        n = img.shape[0]
+        if self._pinned is None or self._pinned.shape[1:] != img.shape[1:] or self._pinned.shape[0] < n \
+                or self._pinned.dtype != img.dtype:
+            self._pinned = torch.empty(img.shape, dtype=img.dtype, pin_memory=True)
+            self._gpu_buf = torch.empty(img.shape, dtype=img.dtype, device='cuda')
+            self._copy_done = torch.cuda.Event()
+        # Do not overwrite the pinned buffer while the previous copy from it is still in flight
+        self._copy_done.synchronize()
+        self._pinned[:n].copy_(img)
+        self._gpu_buf[:n].copy_(self._pinned[:n], non_blocking=True)
+        self._copy_done.record()
+        return self._gpu_buf[:n]
+
+    @staticmethod
+    def _find_to_tensor(transform):
+        """Find the Compose of the transform and the position of ToTensor in it
+
+        Returns
+        -------
+        compose : torchvision.transforms.Compose
+            The Compose, possibly wrapped in OnlyImage. None if there is none or if it has no ToTensor step.
+        to_tensor : int
+            Index of the ToTensor step in the Compose
+        """
+        compose = transform.transform if isinstance(transform, OnlyImage) else transform
+        if not isinstance(compose, transforms.Compose):
+            return None, None
+        to_tensor = next((i for i, t in enumerate(compose.transforms) if isinstance(t, transforms.ToTensor)), None)
+        if to_tensor is None:
+            return None, None
+        return compose, to_tensor
+
+    @staticmethod
+    def _to_tensor_transform(transform):
+        """Build the equivalent of the test transform working on uint8 image tensors instead of PIL images
+
+        ToTensor is replaced by a conversion to float, all other steps must accept tensors (i.e. be nn.Module).
+
+        Parameters
+        ----------
+        transform : torchvision.transforms.Compose | OnlyImage
+            The test transform
 
-    def _load_image(self, input_folder):
+        Returns
+        -------
+        transform : torchvision.transforms.Compose
+            The transform for image tensors. None if one of the steps works only on PIL images.
+        """
+        compose, _ = BaseInference._find_to_tensor(transform)
+        if compose is None:
+            return None
+        steps = []
+        for t in compose.transforms:
+            if isinstance(t, transforms.ToTensor):
+                steps.append(functools.partial(F.convert_image_dtype, dtype=torch.float))
+            elif isinstance(t, torch.nn.Module):
+                steps.append(t)
+            else:
+                return None
+        return transforms.Compose(steps)
+
+    @staticmethod
+    def _script_tensor_transforms(transform):
+        """Replace the steps running after ToTensor (e.g. Normalize) with a single TorchScript module
+
+        The steps before ToTensor work on PIL images and cannot be scripted. If the tensor steps do not script
+        cleanly the eager version is kept.
+
+        Parameters
+        ----------
+        transform : torchvision.transforms.Compose | OnlyImage
+            The test transform
+
+        Returns
+        -------
+        transform : torchvision.transforms.Compose | OnlyImage
+            The same transform, with the tensor steps scripted if possible
+        """
+        compose, to_tensor = BaseInference._find_to_tensor(transform)
+        if compose is None or to_tensor == len(compose.transforms) - 1:
+            return transform
+        tail = compose.transforms[to_tensor + 1:]
+        try:
+            scripted = torch.jit.script(torch.nn.Sequential(*tail))
+        except Exception as exp:
+            logging.warning(f"Could not script the test transform, using the eager version: {exp}")
+            return transform
+        compose.transforms = compose.transforms[:to_tensor + 1] + [scripted]
+        return transform
+
+    @staticmethod
+    def _resize_before_to_tensor(transform):
+        """Move the Resize steps placed after ToTensor in front of it, as long as only Normalize steps are in between
+
+        This way the image is resized in uint8 PIL space instead of converting the full resolution
+        image to a float tensor first, which is both slower and heavier on memory.
+
+        Parameters
+        ----------
+        transform : torchvision.transforms.Compose | OnlyImage
+            The test transform stored in the checkpoint
+
+        Returns
+        -------
+        transform : torchvision.transforms.Compose | OnlyImage
+            The same transform, with the Resize steps re-ordered if necessary
+        """
+        compose, to_tensor = BaseInference._find_to_tensor(transform)
+        if compose is None:
+            return transform
+        steps = compose.transforms
+        # Only the Resize steps preceded by pointwise steps (Normalize) commute with them and can be moved
+        i = to_tensor + 1
+        resizes, pointwise = [], []
+        while i < len(steps) and isinstance(steps[i], (transforms.Resize, transforms.Normalize)):
+            (resizes if isinstance(steps[i], transforms.Resize) else pointwise).append(steps[i])
+            i += 1
+        if resizes:
+            compose.transforms = steps[:to_tensor] + resizes + [steps[to_tensor]] + pointwise + steps[i:]
+            logging.info("Moved Resize before ToTensor in the test transform")
+        return transform
+
+    @classmethod
+    def _load_image(cls, input_folder, draft_size=None):
         """Load the image from the file system"""
         if not os.path.exists(input_folder):
             raise FileNotFoundError(f"Could not find file {input_folder}")
-        img = pil_loader(input_folder)
+        return cls._open_image(input_folder, draft_size=draft_size)
+
+    @staticmethod
+    def _open_image(fp, draft_size=None):
+        """Open an image as RGB, letting the JPEG decoder downscale it to the smallest size >= draft_size"""
+        img = Image.open(fp)
+        if draft_size is not None:
+            img.draft('RGB', draft_size)
+        if img.mode != 'RGB':
+            img = convert_to_rgb(img)
         return img
 
+    @staticmethod
+    def _get_draft_size(transform):
+        """Get the size (width, height) JPEG images can be decoded at without changing the transform output
+
+        This is the case only if the transform starts with a Resize: the image is resized anyway, hence
+        decoding it at a (slightly larger) reduced scale is fine. Otherwise the image is decoded at full size.
+
+        Parameters
+        ----------
+        transform : torchvision.transforms.Compose | OnlyImage
+            The test transform
+
+        Returns
+        -------
+        draft_size : tuple(int, int)
+            The size for Image.draft, None if the image must be decoded at full size
+        """
+        compose = transform.transform if isinstance(transform, OnlyImage) else transform
+        if not isinstance(compose, transforms.Compose) or not compose.transforms \
+                or not isinstance(compose.transforms[0], transforms.Resize):
+            return None
+        size = compose.transforms[0].size
+        if isinstance(size, int):
+            # The shorter side is resized to size: both sides must stay at least as large
+            return size, size
+        if len(size) == 1:
+            return size[0], size[0]
+        return size[1], size[0]
+
     def postprocess(self, output, **kwargs) -> dict:
         """Post process the output of the network and prepare the payload for the response"""
-        # Softmax, argmax then resolve class name and add the activation
-        output = torch.nn.Softmax(dim=1)(output)
-        value, index = torch.max(output, 1)
-        result = [self.classes[index], f"{value.item():.2f}"]
+        # Argmax on the logits (softmax is monotonic) and softmax of the winner only, then resolve class name
+        with inference_mode():
+            # Back to FP32 (if needed) to avoid overflows in the exponential
+            output = output.float()
+            index = output.argmax(1)
+            max_logit = output.gather(1, index.unsqueeze(1))
+            value = torch.exp(max_logit - torch.logsumexp(output, 1, keepdim=True))
+            # Fetch both values with a single device to host transfer
+            value, index = torch.cat([value.view(-1), index.float()]).tolist()
+        result = [self._classes[int(index)], f"{value:.2f}"]
         payload = {'result': result}
         logging.info(f"Returning payload: {payload}")
         return payload
@@ -39,7 +39,7 @@ class BaseSetup:
     ################################################################################################
     # General setup: model, optimizer, lr scheduler and criterion
     @classmethod
-    def setup_model(cls, model_name, no_cuda, num_classes=None, load_model=None, **kwargs):
+    def setup_model(cls, model_name, no_cuda, num_classes=None, load_model=None, checkpoint=None, **kwargs):
         """Setup the model, load and move to GPU if necessary
 
         Parameters
@@ -52,6 +52,8 @@ class BaseSetup:
             How many different classes there are in our problem. Used for loading the model.
         load_model : string
             Path to a saved model
+        checkpoint : dict
+            The checkpoint at `load_model`, if it has already been loaded. Avoids loading it a second time.
 
         Returns
         -------
@@ -73,7 +75,8 @@ class BaseSetup:
             if load_model.startswith("http"):
                 state_dict = load_state_dict_from_url(load_model, progress=False)
             else:
-                checkpoint = torch.load(load_model, map_location=lambda storage, loc: storage)
+                if checkpoint is None:
+                    checkpoint = torch.load(load_model, map_location=lambda storage, loc: storage)
                 # Check consistency with model_name
                 if 'model_name' in checkpoint:
                     if model_name is None:
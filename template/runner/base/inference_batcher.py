@@ -0,0 +1,89 @@
+"""
+This file contains the micro-batching of concurrent inference requests
+"""
+# Utils
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Delegated
+import torch
+
+from util.misc import inference_mode
+
+
+class InferenceBatcher:
+    """Collects the inputs submitted by concurrent callers and runs them through the model as a single mini-batch"""
+
+    def __init__(self, forward, max_batch_size, max_wait_ms):
+        """
+        Parameters
+        ----------
+        forward : callable
+            Function running the forward pass on a mini-batch
+        max_batch_size : int
+            Maximal number of inputs stacked into a single mini-batch
+        max_wait_ms : float
+            Maximal time (in milliseconds) to wait for further inputs once the first one arrived
+        """
+        self.forward = forward
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, input):
+        """Enqueue a mini-batch of size 1
+
+        Parameters
+        ----------
+        input : torch.Tensor
+            The input of shape (1, C, H, W)
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            Future which will hold the output of the network for this input, of shape (1, ...)
+        """
+        future = Future()
+        self._queue.put((input, future))
+        return future
+
+    def _run(self):
+        """Collect the inputs arriving within the waiting window, run them and dispatch the outputs"""
+        while True:
+            requests = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(requests) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # Inputs of different shapes (or devices) cannot be concatenated: run one mini-batch for each
+            groups = {}
+            for input, future in requests:
+                groups.setdefault((tuple(input.shape[1:]), input.device, input.dtype), []).append((input, future))
+            for group in groups.values():
+                self._run_group(group)
+
+    def _run_group(self, requests):
+        """Run a list of (input, future) of the same shape as a single mini-batch and dispatch the outputs"""
+        inputs, futures = zip(*requests)
+        try:
+            # Grad mode is thread local, hence it has to be disabled here
+            with inference_mode():
+                output = self.forward(torch.cat(inputs))
+                # Copies, not views: the next forward pass may reuse the output buffer (e.g. CUDA graphs)
+                outputs = [output[i:i + 1].clone() for i in range(len(futures))]
+        except Exception as exp:
+            for future in futures:
+                future.set_exception(exp)
+            return
+        for future, output in zip(futures, outputs):
+            future.set_result(output)
@@ -5,6 +5,6 @@ from template.runner.image_classification.setup import ImageClassificationSetup
 
 class ImageClassificationInference(BaseInference):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         self.setup = ImageClassificationSetup()
@@ -80,6 +80,13 @@ def make_folder_if_not_exists(path):
         os.makedirs(path)
 
 
+def inference_mode():
+    """Context manager disabling autograd, using torch.inference_mode() where available (PyTorch >= 1.9)"""
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
 def pil_loader(path, to_rgb=True):
     pic = Image.open(path)
     if to_rgb: